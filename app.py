@@ -1,10 +1,21 @@
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, send_from_directory
 import os
+import hmac
+import cProfile
+import json
+import gzip
+import zlib
 import logging
 import random
+import time
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from logging.handlers import RotatingFileHandler
 from datetime import datetime, timezone, date
+import click
+import numpy as np
 import boto3
 from botocore.exceptions import ClientError
 
@@ -28,7 +39,7 @@ app = Flask(__name__)
 
 
 # ========= LOGGING SETUP =========
-LOG_FILE = "/home/ubuntu/logs/ecgenius_logs.txt"
+LOG_FILE = os.getenv("LOG_FILE", "/home/ubuntu/logs/ecgenius_logs.txt")
 
 # Make sure directory exists
 os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
@@ -60,12 +71,221 @@ app.logger.addHandler(console_handler)
 # (OPTIONAL) log every incoming request
 @app.before_request
 def log_request():
+    # Compressed bodies are inflated (with a size limit) by the endpoint itself,
+    # so don't buffer + parse them here.
+    if request.headers.get("Content-Encoding"):
+        body = f"<{request.headers.get('Content-Encoding')} {request.content_length} bytes>"
+    else:
+        body = request.get_json(silent=True)
     app.logger.info(
         f"REQUEST: {request.remote_addr} {request.method} {request.path} "
-        f"args={dict(request.args)} json={request.get_json(silent=True)}"
+        f"args={dict(request.args)} json={body}"
     )
 
 
+# ========= COMPRESSION SETUP =========
+# Request bodies: gzip / deflate accepted on /predict, inflated chunk by chunk
+# and aborted as soon as they grow past MAX_DECOMPRESSED_BYTES (zip bomb guard).
+SUPPORTED_REQUEST_ENCODINGS = ("gzip", "deflate")
+MAX_DECOMPRESSED_BYTES = int(os.getenv("MAX_DECOMPRESSED_BYTES", 2 * 1024 * 1024))  # 2 MB
+DECOMPRESS_CHUNK_SIZE = 16 * 1024
+
+# Responses: endpoints that return the waveform are compressed when the client
+# sends Accept-Encoding and the body is bigger than COMPRESS_MIN_BYTES.
+COMPRESSED_ENDPOINTS = {"get_report", "register"}
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", 6))
+
+
+class DecompressedSizeExceeded(ValueError):
+    pass
+
+
+def read_compressed_body(encoding: str) -> bytes:
+    """
+    Stream the request body through zlib and return the inflated bytes.
+
+    - encoding: "gzip" or "deflate" (zlib-wrapped, raw deflate also accepted)
+
+    Raises:
+      - DecompressedSizeExceeded if output grows past MAX_DECOMPRESSED_BYTES
+      - ValueError if the body is corrupt, truncated, or has data after the
+        end of the compressed stream (incl. multi-member gzip)
+    """
+    if encoding == "gzip":
+        wbits = 16 + zlib.MAX_WBITS
+    else:
+        wbits = zlib.MAX_WBITS
+
+    decomp = zlib.decompressobj(wbits)
+    out = bytearray()
+    first_chunk = True
+
+    while True:
+        chunk = request.stream.read(DECOMPRESS_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        # Some clients send raw deflate without the zlib header
+        if first_chunk and encoding == "deflate" and (
+            len(chunk) < 2 or (chunk[0] & 0x0F) != 8 or (chunk[0] << 8 | chunk[1]) % 31
+        ):
+            decomp = zlib.decompressobj(-zlib.MAX_WBITS)
+        first_chunk = False
+
+        try:
+            # max_length keeps a single small chunk from expanding unbounded
+            while chunk:
+                out += decomp.decompress(chunk, MAX_DECOMPRESSED_BYTES - len(out) + 1)
+                if len(out) > MAX_DECOMPRESSED_BYTES:
+                    raise DecompressedSizeExceeded(
+                        f"Decompressed body exceeds {MAX_DECOMPRESSED_BYTES} bytes"
+                    )
+                chunk = decomp.unconsumed_tail
+        except zlib.error as e:
+            raise ValueError(f"Invalid {encoding} body: {e}")
+
+        # Stop at the end of the stream; anything after it is an error
+        if decomp.eof:
+            if decomp.unused_data or request.stream.read(1):
+                raise ValueError(f"Unexpected data after end of {encoding} stream")
+            break
+
+    try:
+        out += decomp.flush(MAX_DECOMPRESSED_BYTES - len(out) + 1)
+    except zlib.error as e:
+        raise ValueError(f"Invalid {encoding} body: {e}")
+    if len(out) > MAX_DECOMPRESSED_BYTES:
+        raise DecompressedSizeExceeded(
+            f"Decompressed body exceeds {MAX_DECOMPRESSED_BYTES} bytes"
+        )
+    if not decomp.eof:
+        raise ValueError(f"Truncated {encoding} body")
+
+    return bytes(out)
+
+
+@app.after_request
+def compress_response(response):
+    """
+    gzip/deflate the response of waveform-bearing endpoints if the client
+    accepts it and the body is large enough to be worth it.
+    """
+    if request.endpoint not in COMPRESSED_ENDPOINTS:
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    encoding = request.accept_encodings.best_match(["gzip", "deflate"])
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    if encoding == "gzip":
+        data = gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+    else:
+        data = zlib.compress(data, COMPRESS_LEVEL)
+
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
+# ========= END COMPRESSION SETUP =========
+
+
+# ========= PROFILING SETUP =========
+# Opt-in cProfile capture of single requests. A request is profiled when it
+# carries PROFILE_HEADER == PROFILE_TOKEN, or is picked by PROFILE_SAMPLE_RATE.
+# If neither is configured the hooks are never registered (zero overhead).
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_HEADER = "X-ECGenius-Profile"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/home/ubuntu/logs/profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50))  # rotate: keep newest N files
+
+PROFILING_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+# Sampled profiles are only reachable through /admin/profiles, which needs the token
+if PROFILE_SAMPLE_RATE > 0 and not PROFILE_TOKEN:
+    raise RuntimeError("PROFILE_SAMPLE_RATE > 0 requires PROFILE_TOKEN to be set")
+if PROFILE_KEEP < 1:
+    raise RuntimeError(f"PROFILE_KEEP must be >= 1 (got {PROFILE_KEEP})")
+
+
+def is_admin_request() -> bool:
+    token = request.headers.get(PROFILE_HEADER, "")
+    # compare bytes: compare_digest raises TypeError on non-ASCII str, and
+    # werkzeug hands us latin-1 decoded header values
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(
+        token.encode("latin-1", "replace"), PROFILE_TOKEN.encode()
+    )
+
+
+def rotate_profiles():
+    """
+    Delete the oldest .prof files so at most PROFILE_KEEP remain.
+    """
+    files = sorted(
+        (f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof")),
+        key=lambda f: os.path.getmtime(os.path.join(PROFILE_DIR, f)),
+    )
+    for f in files[:-PROFILE_KEEP]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, f))
+        except OSError:
+            pass
+
+
+def start_profiling():
+    if request.endpoint is None or request.endpoint.startswith("admin_"):
+        return
+    if not is_admin_request() and random.random() >= PROFILE_SAMPLE_RATE:
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler already active in this thread
+        return
+    g.profiler = profiler
+
+
+def stop_profiling(exc=None):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    profiler.disable()
+
+    fname = (
+        f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}"
+        f"-{request.endpoint}-{os.urandom(2).hex()}.prof"
+    )
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, fname))
+        rotate_profiles()
+        app.logger.info(f"Request profile written: {fname}")
+    except OSError as e:
+        app.logger.error(f"Failed to write request profile {fname}: {e}")
+
+
+if PROFILING_ENABLED:
+    # run first, so JSON parsing in log_request is inside the profile too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_profiling)
+    app.teardown_request(stop_profiling)
+# ========= END PROFILING SETUP =========
+
+
 # ========= DYNAMODB SETUP =========
 DYNAMO_TABLE_NAME = os.getenv("DYNAMO_TABLE_NAME", "ECGeniusPredictions")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
@@ -73,6 +293,13 @@ AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 dynamodb = boto3.resource("dynamodb", region_name=AWS_REGION)
 pred_table = dynamodb.Table(DYNAMO_TABLE_NAME)
 
+# Predictions never followed by /register expire after this many days via the
+# DynamoDB TTL attribute below (0 = keep forever). Registration removes it.
+# TTL has to be switched on once per table: `flask enable-prediction-ttl`,
+# and items written before that get one via `flask backfill-prediction-ttl`.
+UNREGISTERED_TTL_DAYS = int(os.getenv("UNREGISTERED_TTL_DAYS", 30))
+TTL_ATTRIBUTE = "expires_at"
+
 def save_prediction_to_db(
     prediction_id: str,
     timestamp: str,
@@ -80,7 +307,8 @@ def save_prediction_to_db(
     is_afib: bool,
     is_bbb: bool,
     is_vfi: bool,
-    samples
+    samples,
+    lead_results=None,
 ):
     """
     Save a prediction record to DynamoDB.
@@ -88,12 +316,13 @@ def save_prediction_to_db(
     Fields:
     - prediction_id (PK)
     - timestamp
-    - is_mci, is_afib, is_bbb, is_vfi
+    - is_mci, is_afib, is_bbb, is_vfi (combined over all leads)
     - is_already_visited (False at creation)
-    - samples (JSON string)
+    - samples (JSON string; flat list for 1 lead, [lead][sample] otherwise)
+    - num_leads, leads (per-lead results, multi-lead recordings only)
+    - detector_version (DETECTOR_VERSION that produced the flags)
+    - expires_at (epoch seconds TTL, if UNREGISTERED_TTL_DAYS > 0)
     """
-    import json
-
     item = {
         "prediction_id": prediction_id,
         "timestamp": timestamp,
@@ -103,7 +332,13 @@ def save_prediction_to_db(
         "is_vfi": is_vfi,
         "is_already_visited": False,
         "samples": json.dumps(samples),
+        "detector_version": DETECTOR_VERSION,
     }
+    if lead_results is not None and len(lead_results) > 1:
+        item["num_leads"] = len(lead_results)
+        item["leads"] = lead_results
+    if UNREGISTERED_TTL_DAYS > 0:
+        item[TTL_ATTRIBUTE] = int(time.time()) + UNREGISTERED_TTL_DAYS * 86400
 
     app.logger.info(f"Saving prediction to DynamoDB: {prediction_id}")
     pred_table.put_item(Item=item)
@@ -132,7 +367,7 @@ def register_patient_in_db(
     Register patient info for a given prediction_id.
 
     - Only allowed if is_already_visited is False or not set.
-    - Sets is_already_visited = True.
+    - Sets is_already_visited = True and removes the expiry TTL.
     - Also stores: name, age, gender, phone_no, previous_medication.
 
     Returns:
@@ -148,10 +383,12 @@ def register_patient_in_db(
             UpdateExpression=(
                 "SET #name = :name, age = :age, gender = :gender, "
                 "phone_no = :phone_no, previous_medication = :pm, "
-                "is_already_visited = :true"
+                "is_already_visited = :true "
+                "REMOVE #ttl"
             ),
             ExpressionAttributeNames={
-                "#name": "name"
+                "#name": "name",
+                "#ttl": TTL_ATTRIBUTE,
             },
             ExpressionAttributeValues={
                 ":name": name,
@@ -184,7 +421,7 @@ def update_patient_info_in_db(
 ):
     """
     Update patient info only if is_already_visited is False or not set.
-    Then set is_already_visited = True.
+    Then set is_already_visited = True and remove the expiry TTL.
 
     Returns:
       - dict of updated attributes on success
@@ -197,10 +434,12 @@ def update_patient_info_in_db(
             ConditionExpression="attribute_not_exists(is_already_visited) OR is_already_visited = :false",
             UpdateExpression=(
                 "SET #name = :name, age = :age, gender = :gender, "
-                "previous_medication = :pm, is_already_visited = :true"
+                "previous_medication = :pm, is_already_visited = :true "
+                "REMOVE #ttl"
             ),
             ExpressionAttributeNames={
-                "#name": "name"
+                "#name": "name",
+                "#ttl": TTL_ATTRIBUTE,
             },
             ExpressionAttributeValues={
                 ":name": name,
@@ -245,20 +484,66 @@ def generate_prediction_id() -> str:
 # ==============================
 
 
-def atrial_fibrillation(samples):
-    return False
+# Every function takes `leads`, a float array of shape (num_leads, num_samples),
+# and returns one value per lead. Work on the whole array with numpy ops along
+# axis=-1 instead of looping over leads in Python.
+
+MAX_LEADS = int(os.getenv("MAX_LEADS", 12))
+
+# Bump whenever detector logic changes, then run `flask reanalyze-predictions`
+# to write results_<version> for the stored history.
+DETECTOR_VERSION = "v1"
+
+
+def filter_leads(leads):
+    """
+    Remove each lead's DC offset (its mean) from every lead at once.
+    """
+    return leads - leads.mean(axis=-1, keepdims=True)
+
+
+def atrial_fibrillation(leads):
+    return np.zeros(len(leads), dtype=bool)
+
+def bundle_branch_block(leads):
+    return np.zeros(len(leads), dtype=bool)
+
+def myocardial_infraction(leads):
+    return np.zeros(len(leads), dtype=bool)
+
+def venticular_fibrillation(leads):
+    return np.zeros(len(leads), dtype=bool)
+
+def heart_rate(leads):
+    return np.random.randint(70, 76, size=len(leads))
+
+
+def analyze_leads(leads):
+    """
+    Filter + run all detectors on a (num_leads, num_samples) array.
 
-def bundle_branch_block(samples):
-    return False
+    Returns (combined, per_lead):
+    - combined: flags OR-ed over leads, median heart rate
+    - per_lead: list of the same dict for each lead
+    """
+    filtered = filter_leads(leads)
 
-def myocardial_infraction(samples):
-    return False
+    flags = {
+        "is_mci": myocardial_infraction(filtered),
+        "is_afib": atrial_fibrillation(filtered),
+        "is_bbb": bundle_branch_block(filtered),
+        "is_vfi": venticular_fibrillation(filtered),
+    }
+    hrt = heart_rate(filtered)
 
-def venticular_fibrillation(samples):
-    return False
+    per_lead = [
+        {**{k: bool(v[i]) for k, v in flags.items()}, "heart_rate": int(hrt[i])}
+        for i in range(len(leads))
+    ]
+    combined = {k: bool(np.any(v)) for k, v in flags.items()}
+    combined["heart_rate"] = int(np.median(hrt))
 
-def heart_rate(samples):
-    return random.randint(70, 75)
+    return combined, per_lead
 
 
 
@@ -302,9 +587,13 @@ def api():
             "/predict": {
                 "method": "POST",
                 "description": "Takes a list of ECG samples, computes 4 outputs, "
-                               "stores them in DynamoDB and returns prediction_id.",
+                               "stores them in DynamoDB and returns prediction_id. "
+                               "Body may be sent with Content-Encoding: gzip or deflate.",
                 "input_format_example": {
                     "samples": [0.12, -0.03, 0.45, "... more values ..."]
+                },
+                "multi_lead_input_format_example": {
+                    "samples": [[0.12, -0.03, "..."], [0.08, 0.01, "..."]]
                 }
             },
             "/register": {
@@ -342,15 +631,42 @@ def predict():
     {
         "samples": [v1, v2, ..., vN]
     }
+    or, for multi-lead recordings (leads x samples):
+    {
+        "samples": [[v1, ..., vN], [v1, ..., vN], ...]
+    }
 
     Flow:
     - validate samples
-    - run 4 functions
+    - run 4 functions on all leads at once
     - generate prediction_id + timestamp
     - save all info to DynamoDB
     - return prediction_id + flags
+
+    Body may be gzip/deflate compressed (Content-Encoding header).
     """
-    data = request.get_json(silent=True)
+    encoding = request.headers.get("Content-Encoding", "").strip().lower()
+
+    if encoding in ("", "identity"):
+        data = request.get_json(silent=True)
+    elif encoding not in SUPPORTED_REQUEST_ENCODINGS:
+        return jsonify({
+            "error": f"Unsupported Content-Encoding '{encoding}'.",
+            "supported": list(SUPPORTED_REQUEST_ENCODINGS)
+        }), 415
+    else:
+        try:
+            raw = read_compressed_body(encoding)
+        except DecompressedSizeExceeded as e:
+            app.logger.warning(f"Rejected compressed /predict body: {e}")
+            return jsonify({"error": str(e)}), 413
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            data = None
 
     if data is None:
         return jsonify({"error": "Request body must be JSON."}), 400
@@ -371,28 +687,44 @@ def predict():
     #         "received_length": len(samples)
     #     }), 400
 
-    # Ensure all numeric
+    # Ensure all numeric, and every lead has the same length
+    # (None -> nan with dtype=float64, so also reject anything non-finite)
     try:
-        samples = [float(x) for x in samples]
+        leads = np.asarray(samples, dtype=np.float64)
+        if not np.isfinite(leads).all():
+            raise ValueError("non-finite sample")
     except (TypeError, ValueError):
-        return jsonify({"error": "All values in 'samples' must be numeric."}), 400
+        return jsonify({
+            "error": "'samples' must be a list of numbers, or a list of equal-length "
+                     "lists of numbers (one per lead)."
+        }), 400
+
+    if leads.ndim == 1:
+        leads = leads.reshape(1, -1)
+    elif leads.ndim != 2:
+        return jsonify({"error": "'samples' must have at most 2 dimensions (leads x samples)."}), 400
+
+    if leads.size == 0:
+        return jsonify({"error": "'samples' must not be empty."}), 400
+
+    if len(leads) > MAX_LEADS:
+        return jsonify({"error": f"Too many leads (max {MAX_LEADS}).", "received_leads": len(leads)}), 400
+
+    num_leads = len(leads)
 
     # Run through your four functions
     try:
-        afb = atrial_fibrillation(samples)
-        bbb = bundle_branch_block(samples)
-        mci = myocardial_infraction(samples)
-        vfb = venticular_fibrillation(samples)
-        hrt = heart_rate(samples)
+        results, lead_results = analyze_leads(leads)
     except Exception as e:
         app.logger.exception("Error in prediction functions")
         return jsonify({"error": "Internal error in prediction functions.", "details": str(e)}), 500
 
     # Convert to your flag names
-    is_afib = bool(afb)
-    is_bbb = bool(bbb)
-    is_mci = bool(mci)
-    is_vfi = bool(vfb)
+    is_afib = results["is_afib"]
+    is_bbb = results["is_bbb"]
+    is_mci = results["is_mci"]
+    is_vfi = results["is_vfi"]
+    hrt = results["heart_rate"]
 
     # Generate ID + timestamp
     prediction_id = generate_prediction_id()
@@ -407,7 +739,8 @@ def predict():
             is_afib=is_afib,
             is_bbb=is_bbb,
             is_vfi=is_vfi,
-            samples=samples,
+            samples=leads[0].tolist() if num_leads == 1 else leads.tolist(),
+            lead_results=lead_results,
         )
     except Exception as e:
         app.logger.exception("Failed to save prediction to DynamoDB")
@@ -417,7 +750,7 @@ def predict():
 
     response = {
         "project": "ECGenius",
-        "num_samples": len(samples),
+        "num_samples": leads.shape[1],
         "prediction_id": prediction_id,
         "timestamp": ts,
         "results": {
@@ -429,6 +762,12 @@ def predict():
         }
     }
 
+    # Single-lead clients (ESP32) parse this into a 1 KB buffer,
+    # so only add per-lead detail when there is more than one lead.
+    if num_leads > 1:
+        response["num_leads"] = num_leads
+        response["leads"] = lead_results
+
     return jsonify(response), 200
 
 
@@ -547,11 +886,760 @@ def get_report():
         "previous_medication": item.get("previous_medication"),
         "samples": item.get("samples")
     }
+    if "leads" in item:
+        report["num_leads"] = item.get("num_leads")
+        report["leads"] = item.get("leads")
+    if "samples_archive" in item:
+        report["samples_archive"] = item.get("samples_archive")
 
     return jsonify({"report": report}), 200
 
 
 
+# ==============================
+#  ADMIN: REQUEST PROFILES
+# ==============================
+
+@app.route("/admin/profiles", methods=["GET"])
+def admin_list_profiles():
+    """
+    List captured request profiles (newest first).
+    Requires the X-ECGenius-Profile header to match PROFILE_TOKEN.
+    """
+    if not is_admin_request():
+        return jsonify({"error": "Not found"}), 404
+
+    if not os.path.isdir(PROFILE_DIR):
+        return jsonify({"profiles": []}), 200
+
+    profiles = []
+    for f in os.listdir(PROFILE_DIR):
+        if not f.endswith(".prof"):
+            continue
+        st = os.stat(os.path.join(PROFILE_DIR, f))
+        profiles.append({
+            "name": f,
+            "size_bytes": st.st_size,
+            "created": datetime.fromtimestamp(st.st_mtime, timezone.utc).isoformat(),
+        })
+    profiles.sort(key=lambda p: p["created"], reverse=True)
+
+    return jsonify({"profiles": profiles}), 200
+
+
+@app.route("/admin/profiles/<name>", methods=["GET"])
+def admin_get_profile(name):
+    """
+    Download one .prof file (load with pstats / snakeviz).
+    """
+    if not is_admin_request() or not name.endswith(".prof"):
+        return jsonify({"error": "Not found"}), 404
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
+
+
+# ==============================
+#  EXPORT COMMAND
+# ==============================
+# Bulk export of stored predictions for model retraining:
+#
+#   flask --app app export-predictions /data/export --segments 16 --workers 8
+#
+# Runs a parallel segmented Scan, decodes each waveform into a float32 array
+# and writes shards of at most --shard-size recordings, so memory stays
+# bounded at roughly workers x shard-size recordings. Finished segments are
+# recorded in _checkpoint.json; re-running the same command skips them.
+# Patient info (name, phone_no, ...) is never exported.
+
+EXPORT_ATTRIBUTES = [
+    "prediction_id", "timestamp", "is_mci", "is_afib", "is_bbb", "is_vfi",
+    "is_already_visited", "samples",
+]
+EXPORT_CHECKPOINT = "_checkpoint.json"
+
+# Shared by every Scan-based command so their checkpoints / runs line up
+DEFAULT_SCAN_SEGMENTS = 16
+
+
+def scan_segment(table, segment: int, total_segments: int, attributes,
+                 filter_expression=None, filter_names=None, filter_values=None):
+    """
+    Yield every item of one Scan segment, following LastEvaluatedKey.
+    Optional FilterExpression placeholders come in filter_names / filter_values.
+    """
+    names = {f"#a{i}": a for i, a in enumerate(attributes)}
+    kwargs = {
+        "Segment": segment,
+        "TotalSegments": total_segments,
+        "ProjectionExpression": ", ".join(names),
+        "ExpressionAttributeNames": {**names, **(filter_names or {})},
+    }
+    if filter_expression:
+        kwargs["FilterExpression"] = filter_expression
+        if filter_values:
+            kwargs["ExpressionAttributeValues"] = filter_values
+    while True:
+        resp = table.scan(**kwargs)
+        yield from resp.get("Items", [])
+        if "LastEvaluatedKey" not in resp:
+            return
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def run_segments(fn, segments, workers: int, label: str, on_done, summary):
+    """
+    Run fn(segment) for every segment in a thread pool.
+
+    - on_done(segment, result) is called from this thread for each segment
+      that finished (checkpointing + progress output)
+    - summary() returns the final "Done: ..." line
+
+    Raises ClickException if any segment failed, so the command exits non-zero.
+    """
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn, s): s for s in segments}
+        for fut in as_completed(futures):
+            seg = futures[fut]
+            try:
+                result = fut.result()
+            except Exception as e:
+                failed += 1
+                app.logger.exception(f"{label} segment {seg} failed")
+                click.echo(f"segment {seg}: FAILED ({e})", err=True)
+                continue
+            on_done(seg, result)
+
+    click.echo(summary())
+    if failed:
+        raise click.ClickException(f"{failed} segment(s) failed; re-run to resume")
+
+
+def new_table():
+    """
+    boto3 resources are not thread-safe, so every worker gets its own.
+    """
+    return boto3.session.Session().resource(
+        "dynamodb", region_name=AWS_REGION
+    ).Table(DYNAMO_TABLE_NAME)
+
+
+def write_export_shard(path: str, rows, fmt: str):
+    """
+    Write one shard. Waveforms have variable length, so they are stored as
+    one flat float32 array + per-recording offsets (npz) or a list column
+    (parquet). Multi-lead recordings are flattened lead after lead; reshape
+    with num_leads.
+    """
+    waves = [r["samples"].ravel() for r in rows]
+    lengths = np.array([len(w) for w in waves], dtype=np.int64)
+    num_leads = np.array([r["samples"].shape[0] if r["samples"].ndim == 2 else 1 for r in rows],
+                         dtype=np.int64)
+    meta = {
+        "prediction_id": [r["prediction_id"] for r in rows],
+        "timestamp": [r.get("timestamp", "") for r in rows],
+    }
+    flags = {
+        k: np.array([bool(r.get(k, False)) for r in rows])
+        for k in ("is_mci", "is_afib", "is_bbb", "is_vfi", "is_already_visited")
+    }
+
+    tmp_path = path + ".tmp"
+    if fmt == "npz":
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                samples=np.concatenate(waves) if waves else np.empty(0, np.float32),
+                offsets=np.concatenate(([0], np.cumsum(lengths))),
+                num_leads=num_leads,
+                prediction_id=np.array(meta["prediction_id"], dtype=str),
+                timestamp=np.array(meta["timestamp"], dtype=str),
+                **flags,
+            )
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({
+            **meta,
+            **flags,
+            "num_leads": num_leads,
+            "num_samples": lengths // num_leads,
+            "samples": pa.array(waves, type=pa.list_(pa.float32())),
+        })
+        pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def export_segment(out_dir: str, segment: int, total_segments: int,
+                   shard_size: int, fmt: str):
+    """
+    Export one Scan segment to seg<segment>-<n>.<fmt> shards.
+    Returns (items_written, shard_names).
+    """
+    # Drop leftovers from an interrupted previous run of this segment
+    prefix = f"seg{segment:04d}-"
+    for f in os.listdir(out_dir):
+        if f.startswith(prefix):
+            os.remove(os.path.join(out_dir, f))
+
+    table = new_table()
+    rows, shards, count = [], [], 0
+
+    def flush():
+        name = f"{prefix}{len(shards):05d}.{fmt}"
+        write_export_shard(os.path.join(out_dir, name), rows, fmt)
+        shards.append(name)
+        rows.clear()
+
+    for item in scan_segment(table, segment, total_segments, EXPORT_ATTRIBUTES):
+        if "samples" not in item:
+            continue  # waveform compacted away, see compact-predictions
+        try:
+            item["samples"] = np.asarray(json.loads(item["samples"]), dtype=np.float32)
+        except (TypeError, ValueError):
+            app.logger.warning(f"Export: skipping {item.get('prediction_id')} (bad samples)")
+            continue
+        rows.append(item)
+        count += 1
+        if len(rows) >= shard_size:
+            flush()
+    if rows:
+        flush()
+
+    return count, shards
+
+
+@app.cli.command("export-predictions")
+@click.argument("out_dir")
+@click.option("--format", "fmt", type=click.Choice(["npz", "parquet"]), default="npz")
+@click.option("--segments", default=DEFAULT_SCAN_SEGMENTS, show_default=True,
+              help="Total Scan segments.")
+@click.option("--workers", default=8, show_default=True, help="Segments scanned in parallel.")
+@click.option("--shard-size", default=500, show_default=True, help="Recordings per shard file.")
+def export_predictions(out_dir, fmt, segments, workers, shard_size):
+    """
+    Export all predictions + waveforms to npz / parquet shards in OUT_DIR.
+    """
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise click.ClickException("--format parquet requires pyarrow (pip install pyarrow)")
+
+    os.makedirs(out_dir, exist_ok=True)
+    ckpt_path = os.path.join(out_dir, EXPORT_CHECKPOINT)
+
+    if os.path.exists(ckpt_path):
+        with open(ckpt_path) as f:
+            ckpt = json.load(f)
+        if ckpt["total_segments"] != segments or ckpt["format"] != fmt:
+            raise click.ClickException(
+                f"{out_dir} holds an export with segments={ckpt['total_segments']} "
+                f"format={ckpt['format']}; use the same options or a new directory"
+            )
+    else:
+        ckpt = {"table": DYNAMO_TABLE_NAME, "total_segments": segments,
+                "format": fmt, "completed": {}}
+
+    pending = [s for s in range(segments) if str(s) not in ckpt["completed"]]
+    click.echo(f"Exporting {DYNAMO_TABLE_NAME}: {len(pending)}/{segments} segments left")
+
+    def save_checkpoint():
+        tmp = ckpt_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(ckpt, f, indent=2)
+        os.replace(tmp, ckpt_path)
+
+    def on_done(seg, result):
+        count, shards = result
+        ckpt["completed"][str(seg)] = {"items": count, "shards": shards}
+        save_checkpoint()
+        click.echo(f"segment {seg}: {count} recordings, {len(shards)} shards")
+
+    def summary():
+        total = sum(c["items"] for c in ckpt["completed"].values())
+        return f"Done: {len(ckpt['completed'])}/{segments} segments, {total} recordings"
+
+    run_segments(
+        lambda s: export_segment(out_dir, s, segments, shard_size, fmt),
+        pending, workers, "Export", on_done, summary,
+    )
+
+
+# ==============================
+#  RE-ANALYSIS COMMAND
+# ==============================
+# Re-run the current detectors over every stored recording:
+#
+#   flask --app app reanalyze-predictions --workers 8 --read-rate 200 --write-rate 50
+#
+# Results are written next to the original flags as a versioned map
+#   results_<DETECTOR_VERSION> = {is_mci, is_afib, is_bbb, is_vfi, heart_rate,
+#                                 leads?, analyzed_at}
+# so the upload-time flags are never overwritten. Detectors run in a process
+# pool; Scan segments are read by threads sharing read/write rate limits.
+# After every page the segment's LastEvaluatedKey is checkpointed, so an
+# interrupted run picks up where it stopped. Recordings whose analysis fails
+# are retried on later runs, up to --max-attempts, then reported as
+# permanently failed.
+
+class RateLimiter:
+    """
+    Token bucket shared between threads: acquire(n) blocks until n tokens
+    are available. rate <= 0 disables limiting.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n: float = 1):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # allow a single request bigger than the bucket to go through
+                if self.tokens >= min(n, self.rate):
+                    self.tokens -= n
+                    return
+                wait = (min(n, self.rate) - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def reanalyze_samples(samples_json: str):
+    """
+    Process-pool worker: decode a stored waveform and run the detectors.
+    """
+    leads = np.asarray(json.loads(samples_json), dtype=np.float64)
+    if leads.ndim == 1:
+        leads = leads.reshape(1, -1)
+    return analyze_leads(leads)
+
+
+def reanalyze_segment(segment: int, total_segments: int, version: str, state: dict,
+                      save_state, procs, read_limiter, write_limiter, page_size: int,
+                      max_attempts: int = 3):
+    """
+    Re-analyze one Scan segment, resuming from state["last_key"].
+
+    Items whose analysis failed are kept in state["failed_ids"] ({id: attempts})
+    and retried (by key) first on the next run, since last_key has already
+    moved past them. After max_attempts they move to state["permanently_failed"].
+    """
+    table = new_table()
+    field = f"results_{version}"
+    names = {"#pid": "prediction_id", "#s": "samples", "#dv": "detector_version", "#res": field}
+    projection = "#pid, #s, #dv, #res"
+
+    def analyze_and_write(items):
+        """
+        Returns the prediction_ids that failed analysis.
+        """
+        todo = [
+            it for it in items
+            if field not in it and it.get("detector_version") != version and it.get("samples")
+        ]
+        state["skipped"] += len(items) - len(todo)
+
+        failed_ids = []
+        futures = [procs.submit(reanalyze_samples, it["samples"]) for it in todo]
+        for it, fut in zip(todo, futures):
+            try:
+                combined, per_lead = fut.result()
+            except Exception as e:
+                app.logger.error(f"Re-analysis failed for {it['prediction_id']}: {e}")
+                failed_ids.append(it["prediction_id"])
+                continue
+
+            result = dict(combined, analyzed_at=now_iso_utc())
+            if len(per_lead) > 1:
+                result["leads"] = per_lead
+
+            write_limiter.acquire()
+            try:
+                table.update_item(
+                    Key={"prediction_id": it["prediction_id"]},
+                    ConditionExpression="attribute_exists(prediction_id)",
+                    UpdateExpression="SET #res = :res",
+                    ExpressionAttributeNames={"#res": field},
+                    ExpressionAttributeValues={":res": result},
+                )
+                state["updated"] += 1
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                state["skipped"] += 1  # deleted since the scan
+
+        return failed_ids
+
+    def record_failures(failed_ids, attempts):
+        for pid in failed_ids:
+            n = attempts.get(pid, 0) + 1
+            if n >= max_attempts:
+                state["permanently_failed"].append(pid)
+            else:
+                state["failed_ids"][pid] = n
+
+    state.setdefault("failed_ids", {})
+    state.setdefault("permanently_failed", [])
+
+    # Retry failures from earlier runs
+    retry = dict(state["failed_ids"])
+    if retry:
+        items = []
+        for pid in retry:
+            read_limiter.acquire()
+            item = table.get_item(
+                Key={"prediction_id": pid},
+                ProjectionExpression=projection,
+                ExpressionAttributeNames=names,
+            ).get("Item")
+            if item:
+                items.append(item)
+        failed_ids = analyze_and_write(items)
+        # only forget the old list once the retries are through
+        state["failed_ids"] = {}
+        record_failures(failed_ids, retry)
+        save_state()
+
+    if state["done"]:
+        return state
+
+    kwargs = {
+        "Segment": segment,
+        "TotalSegments": total_segments,
+        "Limit": page_size,
+        "ProjectionExpression": projection,
+        "ExpressionAttributeNames": names,
+    }
+    if state.get("last_key"):
+        kwargs["ExclusiveStartKey"] = state["last_key"]
+
+    while True:
+        read_limiter.acquire(page_size)
+        resp = table.scan(**kwargs)
+
+        record_failures(analyze_and_write(resp.get("Items", [])), {})
+
+        state["last_key"] = resp.get("LastEvaluatedKey")
+        state["done"] = state["last_key"] is None
+        save_state()
+        if state["done"]:
+            return state
+        kwargs["ExclusiveStartKey"] = state["last_key"]
+
+
+@app.cli.command("reanalyze-predictions")
+@click.option("--checkpoint", default=None,
+              help="Progress file (default: reanalyze_<DETECTOR_VERSION>.json in the cwd).")
+@click.option("--segments", default=DEFAULT_SCAN_SEGMENTS, show_default=True,
+              help="Total Scan segments.")
+@click.option("--scan-threads", default=4, show_default=True, help="Segments scanned in parallel.")
+@click.option("--workers", default=os.cpu_count(), show_default=True,
+              help="Detector processes.")
+@click.option("--page-size", default=100, show_default=True, help="Items per Scan page.")
+@click.option("--read-rate", default=100.0, show_default=True,
+              help="Max items read per second (0 = unlimited).")
+@click.option("--write-rate", default=25.0, show_default=True,
+              help="Max item updates per second (0 = unlimited).")
+@click.option("--max-attempts", default=3, show_default=True,
+              help="Give up on a recording after this many failed analyses.")
+def reanalyze_predictions(checkpoint, segments, scan_threads, workers,
+                          page_size, read_rate, write_rate, max_attempts):
+    """
+    Re-run the current detectors over stored recordings into
+    results_<DETECTOR_VERSION>.
+    """
+    # Always the version of the detector code that is actually loaded
+    version = DETECTOR_VERSION
+    checkpoint = checkpoint or f"reanalyze_{version}.json"
+
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            ckpt = json.load(f)
+        if ckpt["version"] != version or ckpt["total_segments"] != segments:
+            raise click.ClickException(
+                f"{checkpoint} is for version={ckpt['version']} "
+                f"segments={ckpt['total_segments']}; match --segments or pass another --checkpoint"
+            )
+    else:
+        ckpt = {
+            "table": DYNAMO_TABLE_NAME,
+            "version": version,
+            "total_segments": segments,
+            "segments": {
+                str(s): {"last_key": None, "done": False, "updated": 0, "skipped": 0,
+                         "failed_ids": {}, "permanently_failed": []}
+                for s in range(segments)
+            },
+        }
+
+    lock = threading.Lock()
+
+    def save_state():
+        with lock:
+            tmp = checkpoint + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(ckpt, f, indent=2)
+            os.replace(tmp, checkpoint)
+
+    pending = [
+        int(s) for s, st in ckpt["segments"].items()
+        if not st["done"] or st.get("failed_ids")
+    ]
+    click.echo(f"Re-analyzing {DYNAMO_TABLE_NAME} into results_{version}: "
+               f"{len(pending)}/{segments} segments left")
+
+    read_limiter = RateLimiter(read_rate)
+    write_limiter = RateLimiter(write_rate)
+
+    def on_done(seg, st):
+        click.echo(f"segment {seg}: {st['updated']} updated, "
+                   f"{st['skipped']} skipped, {len(st['failed_ids'])} failed")
+
+    def summary():
+        done = sum(st["done"] for st in ckpt["segments"].values())
+        updated = sum(st["updated"] for st in ckpt["segments"].values())
+        retry = sum(len(st.get("failed_ids", {})) for st in ckpt["segments"].values())
+        given_up = sum(len(st.get("permanently_failed", [])) for st in ckpt["segments"].values())
+        line = f"Done: {done}/{segments} segments, {updated} recordings updated"
+        if retry:
+            line += f"; {retry} recording(s) failed analysis, re-run to retry them"
+        if given_up:
+            line += (f"; {given_up} recording(s) permanently failed "
+                     f"(see permanently_failed in {checkpoint})")
+        return line
+
+    # forkserver: workers are started from scan threads, and forking a
+    # process with other threads inside boto3/logging can deadlock the child
+    mp_context = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as procs:
+        run_segments(
+            lambda s: reanalyze_segment(
+                s, segments, version, ckpt["segments"][str(s)],
+                save_state, procs, read_limiter, write_limiter, page_size,
+                max_attempts,
+            ),
+            pending, scan_threads, "Re-analysis", on_done, summary,
+        )
+
+
+# ==============================
+#  TTL + COMPACTION COMMANDS
+# ==============================
+# Unregistered predictions expire through the expires_at TTL (see
+# save_prediction_to_db). Registered ones are kept, but their waveform is the
+# bulk of the item, so old ones can be compacted:
+#
+#   flask --app app compact-predictions --older-than-days 180 --archive-dir /data/archive
+#
+# Waveforms are first written to npz shards (same layout as export-predictions)
+# and only then REMOVEd from the item; samples_archive records the shard file.
+# Only items that still have samples are scanned, so re-running is safe.
+
+@app.cli.command("enable-prediction-ttl")
+def enable_prediction_ttl():
+    """
+    Turn on DynamoDB TTL for the expires_at attribute (once per table).
+    """
+    client = boto3.client("dynamodb", region_name=AWS_REGION)
+    desc = client.describe_time_to_live(TableName=DYNAMO_TABLE_NAME)["TimeToLiveDescription"]
+    if desc.get("TimeToLiveStatus") in ("ENABLED", "ENABLING"):
+        click.echo(f"TTL already {desc['TimeToLiveStatus']} on "
+                   f"{DYNAMO_TABLE_NAME}.{desc.get('AttributeName')}")
+        return
+    client.update_time_to_live(
+        TableName=DYNAMO_TABLE_NAME,
+        TimeToLiveSpecification={"Enabled": True, "AttributeName": TTL_ATTRIBUTE},
+    )
+    click.echo(f"TTL enabled on {DYNAMO_TABLE_NAME}.{TTL_ATTRIBUTE}")
+
+
+def backfill_ttl_segment(segment: int, total_segments: int, ttl_seconds: int, write_limiter):
+    """
+    Set expires_at on unregistered items of one segment that don't have it.
+    expires_at is counted from the item's own timestamp, so old abandoned
+    predictions expire right away. Returns the number of items updated.
+    """
+    table = new_table()
+    count = 0
+    items = scan_segment(
+        table, segment, total_segments, ["prediction_id", "timestamp"],
+        filter_expression=(
+            "(attribute_not_exists(#f_visited) OR #f_visited = :false) "
+            "AND attribute_not_exists(#f_ttl)"
+        ),
+        filter_names={"#f_visited": "is_already_visited", "#f_ttl": TTL_ATTRIBUTE},
+        filter_values={":false": False},
+    )
+    for item in items:
+        try:
+            created = int(datetime.fromisoformat(item["timestamp"]).timestamp())
+        except (KeyError, TypeError, ValueError):
+            created = int(time.time())
+
+        write_limiter.acquire()
+        try:
+            table.update_item(
+                Key={"prediction_id": item["prediction_id"]},
+                # don't race a /register that happened after the scan
+                ConditionExpression=(
+                    "attribute_exists(prediction_id) AND attribute_not_exists(#ttl) "
+                    "AND (attribute_not_exists(is_already_visited) OR is_already_visited = :false)"
+                ),
+                UpdateExpression="SET #ttl = :exp",
+                ExpressionAttributeNames={"#ttl": TTL_ATTRIBUTE},
+                ExpressionAttributeValues={":exp": created + ttl_seconds, ":false": False},
+            )
+            count += 1
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    return count
+
+
+@app.cli.command("backfill-prediction-ttl")
+@click.option("--days", default=UNREGISTERED_TTL_DAYS, show_default=True,
+              help="Expire unregistered predictions this many days after their timestamp.")
+@click.option("--segments", default=DEFAULT_SCAN_SEGMENTS, show_default=True,
+              help="Total Scan segments.")
+@click.option("--workers", default=4, show_default=True, help="Segments scanned in parallel.")
+@click.option("--write-rate", default=25.0, show_default=True,
+              help="Max item updates per second (0 = unlimited).")
+def backfill_prediction_ttl(days, segments, workers, write_rate):
+    """
+    Set expires_at on existing unregistered predictions written before TTL.
+    """
+    if days <= 0:
+        raise click.ClickException("--days must be > 0")
+
+    write_limiter = RateLimiter(write_rate)
+    click.echo(f"Backfilling {TTL_ATTRIBUTE} on unregistered predictions in {DYNAMO_TABLE_NAME}")
+
+    total = 0
+
+    def on_done(seg, count):
+        nonlocal total
+        total += count
+        click.echo(f"segment {seg}: {count} updated")
+
+    run_segments(
+        lambda s: backfill_ttl_segment(s, segments, days * 86400, write_limiter),
+        range(segments), workers, "TTL backfill", on_done,
+        lambda: f"Done: {total} predictions given a TTL",
+    )
+
+
+def compact_segment(segment: int, total_segments: int, cutoff: str, archive_dir,
+                    run_id: str, shard_size: int, write_limiter):
+    """
+    Archive (optional) + strip samples of old registered items in one segment.
+    Returns (items_compacted, shard_names).
+    """
+    table = new_table()
+    rows, shards, count = [], [], 0
+
+    def flush():
+        nonlocal count
+        shard = None
+        if archive_dir:
+            shard = f"compact-{run_id}-seg{segment:04d}-{len(shards):05d}.npz"
+            write_export_shard(os.path.join(archive_dir, shard), rows, "npz")
+            shards.append(shard)
+
+        for r in rows:
+            write_limiter.acquire()
+            update = "REMOVE samples SET compacted_at = :now"
+            values = {":now": now_iso_utc()}
+            if shard:
+                update += ", samples_archive = :shard"
+                values[":shard"] = shard
+            try:
+                table.update_item(
+                    Key={"prediction_id": r["prediction_id"]},
+                    ConditionExpression="attribute_exists(samples)",
+                    UpdateExpression=update,
+                    ExpressionAttributeValues=values,
+                )
+                count += 1
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+        rows.clear()
+
+    items = scan_segment(
+        table, segment, total_segments, EXPORT_ATTRIBUTES,
+        filter_expression="#f_visited = :true AND attribute_exists(#f_samples) AND #f_ts < :cutoff",
+        filter_names={"#f_visited": "is_already_visited", "#f_samples": "samples",
+                      "#f_ts": "timestamp"},
+        filter_values={":true": True, ":cutoff": cutoff},
+    )
+    for item in items:
+        try:
+            item["samples"] = np.asarray(json.loads(item["samples"]), dtype=np.float32)
+        except (TypeError, ValueError):
+            app.logger.warning(f"Compaction: skipping {item.get('prediction_id')} (bad samples)")
+            continue
+        rows.append(item)
+        if len(rows) >= shard_size:
+            flush()
+    if rows:
+        flush()
+
+    return count, shards
+
+
+@app.cli.command("compact-predictions")
+@click.option("--older-than-days", default=180, show_default=True,
+              help="Only registered predictions older than this are compacted.")
+@click.option("--archive-dir", default=None, help="Write waveforms to npz shards here first.")
+@click.option("--discard", is_flag=True, help="Strip waveforms without archiving them.")
+@click.option("--segments", default=DEFAULT_SCAN_SEGMENTS, show_default=True,
+              help="Total Scan segments.")
+@click.option("--workers", default=4, show_default=True, help="Segments scanned in parallel.")
+@click.option("--shard-size", default=500, show_default=True, help="Recordings per archive shard.")
+@click.option("--write-rate", default=25.0, show_default=True,
+              help="Max item updates per second (0 = unlimited).")
+def compact_predictions(older_than_days, archive_dir, discard, segments, workers,
+                        shard_size, write_rate):
+    """
+    Strip (and archive) waveforms from old registered predictions.
+    """
+    if not archive_dir and not discard:
+        raise click.ClickException("Pass --archive-dir, or --discard to drop waveforms")
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+
+    cutoff = datetime.fromtimestamp(
+        time.time() - older_than_days * 86400, timezone.utc
+    ).isoformat()
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    write_limiter = RateLimiter(write_rate)
+
+    click.echo(f"Compacting {DYNAMO_TABLE_NAME}: registered predictions before {cutoff}")
+
+    total = 0
+
+    def on_done(seg, result):
+        nonlocal total
+        count, shards = result
+        total += count
+        click.echo(f"segment {seg}: {count} compacted, {len(shards)} shards")
+
+    run_segments(
+        lambda s: compact_segment(s, segments, cutoff, archive_dir,
+                                  run_id, shard_size, write_limiter),
+        range(segments), workers, "Compaction", on_done,
+        lambda: f"Done: {total} predictions compacted",
+    )
+
+
 # ==============================
 # 🚀 MAIN
 # ==============================
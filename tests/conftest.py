@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py sets up file logging + a boto3 resource at import time
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.mkdtemp(), "ecgenius_logs.txt"))
+os.environ.setdefault("AWS_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+class FakeTable:
+    """
+    In-memory stand-in for the DynamoDB Table resource.
+    Records put_item / update_item calls.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.updates = []
+
+    def put_item(self, Item):
+        self.items.append(Item)
+
+    def update_item(self, **kwargs):
+        self.updates.append(kwargs)
+        return {"Attributes": {}}
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeTable()
+    monkeypatch.setattr(app_module, "pred_table", table)
+    return table
+
+
+@pytest.fixture
+def client(table):
+    return app_module.app.test_client()
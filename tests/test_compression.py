@@ -0,0 +1,101 @@
+import gzip
+import json
+import zlib
+
+import pytest
+
+import app as app_module
+
+
+def post_predict(client, body: bytes, encoding: str):
+    return client.post(
+        "/predict",
+        data=body,
+        headers={"Content-Type": "application/json", "Content-Encoding": encoding},
+    )
+
+
+PAYLOAD = json.dumps({"samples": [0.1, -0.2, 0.3] * 100}).encode()
+
+
+def test_predict_accepts_gzip(client):
+    resp = post_predict(client, gzip.compress(PAYLOAD), "gzip")
+    assert resp.status_code == 200
+    assert resp.get_json()["num_samples"] == 300
+
+
+def test_predict_accepts_zlib_and_raw_deflate(client):
+    resp = post_predict(client, zlib.compress(PAYLOAD), "deflate")
+    assert resp.status_code == 200
+
+    comp = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    raw = comp.compress(PAYLOAD) + comp.flush()
+    resp = post_predict(client, raw, "deflate")
+    assert resp.status_code == 200
+    assert resp.get_json()["num_samples"] == 300
+
+
+def test_predict_rejects_decompression_bomb(client, monkeypatch):
+    monkeypatch.setattr(app_module, "MAX_DECOMPRESSED_BYTES", 1024)
+    resp = post_predict(client, gzip.compress(PAYLOAD), "gzip")
+    assert resp.status_code == 413
+
+
+def test_predict_rejects_truncated_body(client):
+    resp = post_predict(client, gzip.compress(PAYLOAD)[:-8], "gzip")
+    assert resp.status_code == 400
+
+
+def test_predict_rejects_trailing_data(client):
+    resp = post_predict(client, gzip.compress(PAYLOAD) + b"garbage", "gzip")
+    assert resp.status_code == 400
+
+
+def test_predict_rejects_unknown_encoding(client):
+    resp = post_predict(client, PAYLOAD, "br")
+    assert resp.status_code == 415
+
+
+@pytest.fixture
+def report_client(client, monkeypatch):
+    item = {
+        "prediction_id": "2025-01-01-deadbeef",
+        "timestamp": "2025-01-01T00:00:00+00:00",
+        "is_already_visited": True,
+        "samples": json.dumps([0.5] * 2000),
+    }
+    monkeypatch.setattr(app_module, "get_prediction_from_db", lambda pid: item)
+    return client
+
+
+def get_report(client, accept_encoding=None):
+    headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+    return client.post(
+        "/get_report", json={"prediction_id": "2025-01-01-deadbeef"}, headers=headers
+    )
+
+
+def test_report_compressed_above_threshold(report_client):
+    resp = get_report(report_client, "gzip")
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in resp.headers["Vary"]
+    body = json.loads(gzip.decompress(resp.get_data()))
+    assert body["report"]["prediction_id"] == "2025-01-01-deadbeef"
+
+
+def test_report_deflate_negotiated(report_client):
+    resp = get_report(report_client, "deflate, gzip;q=0")
+    assert resp.headers["Content-Encoding"] == "deflate"
+    json.loads(zlib.decompress(resp.get_data()))
+
+
+def test_report_not_compressed_below_threshold(report_client, monkeypatch):
+    monkeypatch.setattr(app_module, "COMPRESS_MIN_BYTES", 10 * 1024 * 1024)
+    resp = get_report(report_client, "gzip")
+    assert "Content-Encoding" not in resp.headers
+    assert resp.get_json()["report"]["prediction_id"] == "2025-01-01-deadbeef"
+
+
+def test_report_not_compressed_without_accept_encoding(report_client):
+    resp = get_report(report_client)
+    assert "Content-Encoding" not in resp.headers
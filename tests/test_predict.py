@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import app as app_module
+
+
+def post_samples(client, samples):
+    return client.post("/predict", json={"samples": samples})
+
+
+def test_single_lead_response_shape_unchanged(client, table):
+    # esp_code.ino parses this into a StaticJsonDocument<1024>
+    resp = post_samples(client, [512, 530, 498, 2048] * 50)
+    assert resp.status_code == 200
+
+    body = resp.get_json()
+    assert set(body) == {"project", "num_samples", "prediction_id", "timestamp", "results"}
+    assert set(body["results"]) == {"is_mci", "is_afib", "is_bbb", "is_vfi", "heart_rate"}
+    assert body["num_samples"] == 200
+    assert isinstance(body["results"]["heart_rate"], int)
+    assert all(isinstance(body["results"][k], bool)
+               for k in ("is_mci", "is_afib", "is_bbb", "is_vfi"))
+    assert len(resp.get_data()) < 1024
+
+    item = table.items[0]
+    assert json.loads(item["samples"]) == [512.0, 530.0, 498.0, 2048.0] * 50
+    assert "num_leads" not in item and "leads" not in item
+
+
+def test_multi_lead(client, table):
+    resp = post_samples(client, [[1, 2, 3, 4], [5, 6, 7, 8], [0, 0, 1, 1]])
+    assert resp.status_code == 200
+
+    body = resp.get_json()
+    assert body["num_samples"] == 4
+    assert body["num_leads"] == 3
+    assert len(body["leads"]) == 3
+
+    item = table.items[0]
+    assert json.loads(item["samples"]) == [[1, 2, 3, 4], [5, 6, 7, 8], [0, 0, 1, 1]]
+    assert item["num_leads"] == 3
+    assert len(item["leads"]) == 3
+
+
+@pytest.mark.parametrize("samples", [
+    [[1, 2, 3], [4, 5]],          # ragged leads
+    [[[1, 2], [3, 4]]],           # 3-D
+    [1, None, 3],
+    [[1, 2], [None, 4]],
+    [1, "Infinity", 3],
+    [1, "NaN", 3],
+    [1, "abc", 3],
+    [1, [2, 3]],
+    [],
+    [[]],
+    [[], []],
+])
+def test_invalid_samples_rejected(client, table, samples):
+    resp = post_samples(client, samples)
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
+    assert table.items == []
+
+
+def test_infinity_literal_rejected(client, table):
+    # Python's json accepts the bare Infinity token
+    resp = client.post("/predict", data='{"samples": [1, Infinity, 3]}',
+                       content_type="application/json")
+    assert resp.status_code == 400
+    assert table.items == []
+
+
+def test_too_many_leads(client, table, monkeypatch):
+    monkeypatch.setattr(app_module, "MAX_LEADS", 2)
+    resp = post_samples(client, [[1, 2], [3, 4], [5, 6]])
+    assert resp.status_code == 400
+    assert resp.get_json()["received_leads"] == 3
+    assert table.items == []
+
+
+def test_samples_must_be_list(client):
+    assert post_samples(client, "1,2,3").status_code == 400
+    assert client.post("/predict", json={"nope": []}).status_code == 400
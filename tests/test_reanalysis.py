@@ -0,0 +1,230 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.exceptions import ClientError
+
+import app as app_module
+
+FIELD = f"results_{app_module.DETECTOR_VERSION}"
+
+
+class PagingTable:
+    """
+    Fake Table whose scan() pages by prediction_id on Limit / ExclusiveStartKey.
+    fail_scan_on: 1-based scan call number that raises (simulated crash).
+    """
+
+    def __init__(self, items, fail_scan_on=None):
+        self.items = {it["prediction_id"]: dict(it) for it in items}
+        self.fail_scan_on = fail_scan_on
+        self.scans = []
+        self.updated = []
+
+    def scan(self, **kwargs):
+        self.scans.append(kwargs)
+        if len(self.scans) == self.fail_scan_on:
+            raise RuntimeError("connection reset")
+
+        keys = sorted(self.items)
+        start = kwargs.get("ExclusiveStartKey")
+        if start:
+            keys = [k for k in keys if k > start["prediction_id"]]
+        page = keys[:kwargs["Limit"]]
+
+        resp = {"Items": [dict(self.items[k]) for k in page]}
+        if len(keys) > len(page):
+            resp["LastEvaluatedKey"] = {"prediction_id": page[-1]}
+        return resp
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(Key["prediction_id"])
+        return {"Item": dict(item)} if item else {}
+
+    def update_item(self, Key, ExpressionAttributeNames, ExpressionAttributeValues, **kwargs):
+        pid = Key["prediction_id"]
+        if pid not in self.items:
+            raise ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+            )
+        self.items[pid][ExpressionAttributeNames["#res"]] = ExpressionAttributeValues[":res"]
+        self.updated.append(pid)
+
+
+def make_items(n, samples="[1, 2, 3, 4]"):
+    return [{"prediction_id": f"p{i:03d}", "samples": samples} for i in range(n)]
+
+
+def new_state():
+    return {"last_key": None, "done": False, "updated": 0, "skipped": 0,
+            "failed_ids": {}, "permanently_failed": []}
+
+
+@pytest.fixture
+def procs():
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+def run(table, state, procs, monkeypatch, max_attempts=3):
+    monkeypatch.setattr(app_module, "new_table", lambda: table)
+    unlimited = app_module.RateLimiter(0)
+    return app_module.reanalyze_segment(
+        0, 1, app_module.DETECTOR_VERSION, state, lambda: None, procs,
+        unlimited, unlimited, page_size=4, max_attempts=max_attempts,
+    )
+
+
+def test_all_items_analyzed(procs, monkeypatch):
+    table = PagingTable(make_items(10))
+    state = run(table, new_state(), procs, monkeypatch)
+
+    assert state["done"] and state["last_key"] is None
+    assert state["updated"] == 10
+    assert sorted(table.updated) == sorted(table.items)
+    assert all(set(it[FIELD]) >= {"is_mci", "is_afib", "is_bbb", "is_vfi", "heart_rate"}
+               for it in table.items.values())
+
+
+def test_resume_after_interrupted_page(procs, monkeypatch):
+    table = PagingTable(make_items(10), fail_scan_on=2)
+    state = new_state()
+
+    with pytest.raises(RuntimeError):
+        run(table, state, procs, monkeypatch)
+    # first page finished + checkpointed, second page never happened
+    assert state["last_key"] == {"prediction_id": "p003"}
+    assert not state["done"]
+
+    run(table, state, procs, monkeypatch)
+    assert table.scans[2]["ExclusiveStartKey"] == {"prediction_id": "p003"}
+    assert state["done"]
+    # every item written exactly once across both runs
+    assert sorted(table.updated) == sorted(table.items)
+
+
+def test_skips_already_analyzed_items(procs, monkeypatch):
+    items = make_items(6)
+    items[1][FIELD] = {"is_mci": True}
+    items[2]["detector_version"] = app_module.DETECTOR_VERSION
+    items[3]["samples"] = None
+    table = PagingTable(items)
+
+    state = run(table, new_state(), procs, monkeypatch)
+
+    assert state["updated"] == 3
+    assert state["skipped"] == 3
+    assert sorted(table.updated) == ["p000", "p004", "p005"]
+    assert table.items["p001"][FIELD] == {"is_mci": True}
+
+
+def test_failed_ids_retried_on_next_run(procs, monkeypatch):
+    table = PagingTable(make_items(5))
+    table.items["p002"]["samples"] = "[9, 9, 9]"
+    real = app_module.reanalyze_samples
+    broken = {"on": True}
+
+    def flaky(samples_json):
+        # detector crashes on p002 only, until "fixed"
+        if broken["on"] and samples_json == "[9, 9, 9]":
+            raise ValueError("detector crashed")
+        return real(samples_json)
+
+    monkeypatch.setattr(app_module, "reanalyze_samples", flaky)
+    state = run(table, new_state(), procs, monkeypatch)
+    assert state["done"]
+    assert state["failed_ids"] == {"p002": 1}
+    assert FIELD not in table.items["p002"]
+
+    broken["on"] = False
+    scans_before = len(table.scans)
+    state = run(table, state, procs, monkeypatch)
+
+    assert state["failed_ids"] == {}
+    assert state["permanently_failed"] == []
+    assert FIELD in table.items["p002"]
+    # segment was already done: retry by key only, no new scan
+    assert len(table.scans) == scans_before
+
+
+def test_gives_up_after_max_attempts(procs, monkeypatch):
+    table = PagingTable(make_items(3))
+    table.items["p001"]["samples"] = "not json"
+    state = new_state()
+
+    run(table, state, procs, monkeypatch, max_attempts=2)
+    assert state["failed_ids"] == {"p001": 1}
+
+    run(table, state, procs, monkeypatch, max_attempts=2)
+    assert state["failed_ids"] == {}
+    assert state["permanently_failed"] == ["p001"]
+
+    # not fetched or retried again
+    monkeypatch.setattr(table, "get_item", lambda **kw: pytest.fail("retried"))
+    run(table, state, procs, monkeypatch, max_attempts=2)
+    assert state["permanently_failed"] == ["p001"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(app_module.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(app_module.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_rate_limiter_burst_then_throttle(clock):
+    limiter = app_module.RateLimiter(10)
+    for _ in range(10):
+        limiter.acquire()
+    assert clock.slept == []
+
+    limiter.acquire()
+    assert sum(clock.slept) == pytest.approx(0.1)
+
+    # 20 more tokens at 10/s take ~2 s
+    start = clock.now
+    for _ in range(20):
+        limiter.acquire()
+    assert clock.now - start == pytest.approx(2.0)
+
+
+def test_rate_limiter_refills_over_time(clock):
+    limiter = app_module.RateLimiter(5)
+    for _ in range(5):
+        limiter.acquire()
+    clock.now += 10  # idle: bucket refills, but never above its size
+    for _ in range(5):
+        limiter.acquire()
+    assert clock.slept == []
+    limiter.acquire()
+    assert sum(clock.slept) == pytest.approx(0.2)
+
+
+def test_rate_limiter_oversized_request_passes(clock):
+    limiter = app_module.RateLimiter(10)
+    limiter.acquire(100)  # e.g. a scan page bigger than the bucket
+    assert clock.slept == []
+    limiter.acquire()
+    # bucket went into debt and has to be paid back first
+    assert sum(clock.slept) == pytest.approx(9.1)
+
+
+def test_rate_limiter_disabled(clock):
+    limiter = app_module.RateLimiter(0)
+    for _ in range(1000):
+        limiter.acquire()
+    assert clock.slept == []